@@ -2,20 +2,104 @@
 """
 Add Bulgarian and English Examples to Anki Cards
 This script reads examples from bulgarian_words_1000_v2.tsv and adds them to existing cards in the Anki deck.
+
+AnkiConnect is reached at the ANKI_CONNECT_URL environment variable, by default
+http://localhost:8765. Use http+unix://%2Fpath%2Fto%2Fanki.sock to connect over a
+UNIX domain socket instead.
 """
 
 import csv
-import json
+import hashlib
+import io
+import os
+import re
+import sys
+import unicodedata
+from collections import namedtuple
+import httpx
+import orjson
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from operator import itemgetter
+from requests.adapters import HTTPAdapter
 from typing import Dict, List, Optional, Tuple
 from pathlib import Path
+from urllib.parse import unquote
+
+DEFAULT_ANKI_CONNECT_URL = "http://localhost:8765"
+
+# URL scheme for reaching AnkiConnect over a UNIX domain socket, with the
+# percent-encoded socket path as the host, e.g. http+unix://%2Ftmp%2Fanki.sock
+UNIX_SOCKET_SCHEME = "http+unix://"
+
+# Number of updateNoteFields actions sent per AnkiConnect "multi" request
+UPDATE_BATCH_SIZE = 50
+
+# Maximum number of AnkiConnect requests in flight at once
+MAX_WORKERS = 8
+
+# Number of Front values combined into the regex of a single findNotes query
+FRONT_QUERY_CHUNK_SIZE = 100
+
+# Whitespace and &nbsp; entities around a field value, ignored when matching
+_EDGE_BLANK_RE = re.compile(r'^(?:\s|&nbsp;)+|(?:\s|&nbsp;)+$')
+
+# Characters with a special meaning in the regex syntax of Anki's re: search
+_SEARCH_REGEX_META = set('\\.+*?()|[]{}^$')
+
+# Read buffer used when streaming the examples TSV
+TSV_BUFFER_SIZE = 1 << 20
+
+# Note fields kept in the on-disk notes cache
+CACHED_FIELDS = ('Front', 'Bulgarian_Example', 'English_Example')
+
+
+# Examples loaded from the TSV file, keyed by normalized Bulgarian text
+Example = namedtuple('Example', ('english', 'bulgarian_example', 'english_example'))
+
+
+@lru_cache(maxsize=4096)
+def normalize_key(text: str) -> str:
+    """Normalize Bulgarian text for matching TSV rows against Front fields.
+    
+    Surrounding whitespace and &nbsp; entities are dropped. Case is kept:
+    the TSV has distinct words that differ only in case ("за"/"За").
+    """
+    return _EDGE_BLANK_RE.sub('', unicodedata.normalize('NFC', text))
 
 
 class AnkiConnect:
     """Simple AnkiConnect interface for updating cards"""
     
-    def __init__(self, url: str = "http://localhost:8765"):
+    def __init__(self, url: str = DEFAULT_ANKI_CONNECT_URL, timeout: float = 30):
         self.url = url
+        self.timeout = timeout
+        self.uds_client = None
+        
+        if url.startswith(UNIX_SOCKET_SCHEME):
+            socket_path = unquote(url[len(UNIX_SOCKET_SCHEME):].split('/', 1)[0])
+            if os.path.exists(socket_path):
+                # Skip the loopback TCP stack entirely; the host part of the
+                # URL is ignored by the socket transport
+                self.uds_client = httpx.Client(
+                    transport=httpx.HTTPTransport(uds=socket_path),
+                    headers={"Content-Type": "application/json"},
+                    timeout=timeout
+                )
+                self.url = "http://localhost/"
+            else:
+                print(f"Warning: AnkiConnect socket {socket_path} not found, using {DEFAULT_ANKI_CONNECT_URL}")
+                self.url = DEFAULT_ANKI_CONNECT_URL
+        
+        # Reuse one keep-alive connection for every request instead of
+        # opening a new socket per call
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS))
+        self.session.headers.update({
+            "Connection": "keep-alive",
+            "Content-Type": "application/json"
+        })
     
     def request(self, action: str, params: Optional[Dict] = None) -> Dict:
         """Send request to AnkiConnect"""
@@ -28,31 +112,44 @@ class AnkiConnect:
             "params": params
         }
         
+        body = orjson.dumps(request_data)
+        
         try:
-            response = requests.post(self.url, json=request_data)
+            if self.uds_client is not None:
+                response = self.uds_client.post(self.url, content=body)
+            else:
+                response = self.session.post(self.url, data=body, timeout=self.timeout)
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
             
             if result.get("error"):
                 raise Exception(f"AnkiConnect error: {result['error']}")
                 
             return result["result"]
-        except requests.exceptions.ConnectionError:
+        except (requests.exceptions.ConnectionError, httpx.ConnectError):
             raise Exception("Could not connect to Anki. Make sure Anki is running and AnkiConnect add-on is installed.")
     
     def get_deck_names(self) -> List[str]:
         """Get all deck names"""
         return self.request("deckNames")
     
+    def find_notes(self, query: str) -> List[int]:
+        """Find note IDs matching an Anki search query"""
+        return self.request("findNotes", {"query": query})
+    
     def find_notes_in_deck(self, deck_name: str) -> List[int]:
         """Find all note IDs in a specific deck"""
         query = f"deck:\"{deck_name}\""
-        return self.request("findNotes", {"query": query})
+        return self.find_notes(query)
     
     def get_notes_info(self, note_ids: List[int]) -> List[Dict]:
         """Get note information"""
         return self.request("notesInfo", {"notes": note_ids})
     
+    def get_notes_mod_time(self, note_ids: List[int]) -> List[Dict]:
+        """Get the last modification time of each note"""
+        return self.request("notesModTime", {"notes": note_ids})
+    
     def get_model_names(self) -> List[str]:
         """Get all note type (model) names"""
         return self.request("modelNames")
@@ -72,48 +169,91 @@ class AnkiConnect:
         
         return self.request("addField", params)
     
+    @staticmethod
+    def update_note_fields_action(note_id: int, fields: Dict[str, str]) -> Dict:
+        """Build an updateNoteFields action for use with multi()"""
+        return {
+            "action": "updateNoteFields",
+            "version": 6,
+            "params": {"note": {"id": note_id, "fields": fields}}
+        }
+    
     def update_note_fields(self, note_id: int, fields: Dict[str, str]):
         """Update note fields"""
-        self.request("updateNoteFields", {
-            "note": {
-                "id": note_id,
-                "fields": fields
-            }
-        })
+        self.request("updateNoteFields", self.update_note_fields_action(note_id, fields)["params"])
+    
+    def multi(self, actions: List[Dict]) -> List[Dict]:
+        """Send several actions in a single request.
+        
+        Each action should carry its own "version" so AnkiConnect returns a
+        {"result": ..., "error": ...} entry per action instead of failing the
+        whole batch.
+        """
+        return self.request("multi", {"actions": actions})
 
 
 class ExampleUpdater:
     """Updates Anki cards with examples from TSV file"""
     
-    def __init__(self, tsv_file: str, deck_name: str = "Rees-Bulgarian-Vocab"):
+    def __init__(self, tsv_file: str, deck_name: str = "Rees-Bulgarian-Vocab", verbose: bool = False,
+                 use_cache: bool = True):
         self.tsv_file = Path(tsv_file)
         self.deck_name = deck_name
-        self.anki = AnkiConnect()
+        self.verbose = verbose
+        self.use_cache = use_cache
+        self.cache_dir = Path(".anki_cache")
+        self.log_buf = []
+        self.anki = AnkiConnect(os.getenv('ANKI_CONNECT_URL', DEFAULT_ANKI_CONNECT_URL))
         self.examples_data = {}
+        self.front_terms = []
+        self.total_notes = 0
         
     def load_examples_from_tsv(self):
         """Load examples from TSV file"""
         print(f"Loading examples from {self.tsv_file}...")
         
-        if not self.tsv_file.exists():
-            raise FileNotFoundError(f"TSV file not found: {self.tsv_file}")
+        try:
+            raw = open(self.tsv_file, 'rb', buffering=TSV_BUFFER_SIZE)
+        except FileNotFoundError as e:
+            raise FileNotFoundError(f"TSV file not found: {self.tsv_file}") from e
         
-        with open(self.tsv_file, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file, delimiter='\t')
+        with raw, io.TextIOWrapper(raw, encoding='utf-8', newline='') as file:
+            reader = csv.reader(file, delimiter='\t')
             
-            for row in reader:
-                bulgarian = row.get('Bulgarian', '').strip()
-                english = row.get('English', '').strip()
-                bulgarian_example = row.get('Bulgarian_Example', '').strip()
-                english_example = row.get('English_Example', '').strip()
-                
-                if bulgarian and bulgarian_example and english_example:
-                    # Use Bulgarian text as key to match with Front field
-                    self.examples_data[bulgarian] = {
-                        'english': english,
-                        'bulgarian_example': bulgarian_example,
-                        'english_example': english_example
-                    }
+            # Resolve column positions once from the header row
+            header = next(reader, [])
+            try:
+                bi = header.index('Bulgarian')
+                ei = header.index('English')
+                bxi = header.index('Bulgarian_Example')
+                exi = header.index('English_Example')
+            except ValueError as e:
+                raise ValueError(f"TSV file {self.tsv_file} is missing a required column: {e}") from e
+            
+            width = max(bi, ei, bxi, exi) + 1
+            pad = [''] * width
+            pick = itemgetter(bi, ei, bxi, exi)
+            strip = str.strip
+            
+            rows = [
+                (bulgarian, english, bulgarian_example, english_example)
+                for row in reader
+                for bulgarian, english, bulgarian_example, english_example in (
+                    map(strip, pick(row if len(row) >= width else row + pad)),
+                )
+                if bulgarian and bulgarian_example and english_example
+            ]
+        
+        # Key on normalized Bulgarian text to match with the Front field
+        self.examples_data = {
+            normalize_key(bulgarian): Example(english, bulgarian_example, english_example)
+            for bulgarian, english, bulgarian_example, english_example in rows
+        }
+        
+        # Search Anki for each word as spelled in the TSV, escaped once so
+        # query chunks are plain joins
+        escape = self.escape_search_regex
+        self.front_terms = [escape(word) for word in dict.fromkeys(row[0] for row in rows)]
         
         print(f"Loaded {len(self.examples_data)} examples from TSV file")
     
@@ -122,20 +262,142 @@ class ExampleUpdater:
         deck_names = self.anki.get_deck_names()
         return self.deck_name in deck_names
     
-    def get_notes_from_deck(self) -> List[Dict]:
-        """Get all notes from the target deck"""
-        note_ids = self.anki.find_notes_in_deck(self.deck_name)
+    def get_notes_from_deck(self, note_ids: Optional[List[int]] = None) -> List[Dict]:
+        """Get the notes in the target deck whose Front matches a TSV word.
+        
+        Note info comes from the on-disk cache when it is still valid, and
+        otherwise from notesInfo for the matching notes only.
+        """
+        if note_ids is None:
+            note_ids = self.anki.find_notes_in_deck(self.deck_name)
         if not note_ids:
             raise Exception(f"No notes found in deck '{self.deck_name}'")
         
-        notes = self.anki.get_notes_info(note_ids)
-        print(f"Found {len(notes)} notes in deck '{self.deck_name}'")
+        self.total_notes = len(note_ids)
+        print(f"Found {self.total_notes} notes in deck '{self.deck_name}'")
+        
+        cache_token = self.notes_cache_token(note_ids) if self.use_cache else None
+        if cache_token:
+            notes = self.load_cached_notes(cache_token)
+            if notes is not None:
+                print(f"Using cached note info for {len(notes)} notes")
+                return notes
+        
+        # Only fetch full note info for notes whose Front has an example
+        candidate_ids = self.find_candidate_note_ids()
+        note_ids = [note_id for note_id in note_ids if note_id in candidate_ids]
+        print(f"{len(note_ids)} notes have a Front value present in the TSV file")
+        
+        notes = self.anki.get_notes_info(note_ids) if note_ids else []
+        
+        if cache_token:
+            self.save_cached_notes(cache_token, notes)
+        
         return notes
     
-    def ensure_example_fields_exist(self, notes: List[Dict]):
-        """Ensure the note type has fields for examples"""
+    @property
+    def notes_cache_path(self) -> Path:
+        """Path of the on-disk notes cache for the target deck"""
+        safe_name = re.sub(r'[^\w.-]', '_', self.deck_name)
+        return self.cache_dir / f"{safe_name}.json"
+    
+    def notes_cache_token(self, note_ids: List[int]) -> Optional[str]:
+        """Build a validity token from the deck's notes and the TSV file.
+        
+        The token covers each note's modification time, so edits made in
+        Anki since the cache was saved invalidate it. Returns None, meaning
+        the cache is not used, if Anki cannot report modification times.
+        """
+        try:
+            mod_times = self.anki.get_notes_mod_time(note_ids)
+        except Exception as e:
+            print(f"Warning: Could not get note modification times, not using the notes cache: {e}")
+            return None
+        
+        stat = self.tsv_file.stat()
+        digest = hashlib.sha1(orjson.dumps(sorted((note['noteId'], note['mod']) for note in mod_times)))
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode('utf-8'))
+        return digest.hexdigest()
+    
+    def load_cached_notes(self, token: str) -> Optional[List[Dict]]:
+        """Return cached notes if they were saved with the same token"""
+        try:
+            cached = orjson.loads(self.notes_cache_path.read_bytes())
+        except (OSError, orjson.JSONDecodeError):
+            return None
+        
+        if cached.get('token') != token:
+            return None
+        return cached.get('notes')
+    
+    def save_cached_notes(self, token: str, notes: List[Dict]):
+        """Save the fields this script needs from each note to the cache"""
+        trimmed = [
+            {
+                'noteId': note['noteId'],
+                'modelName': note['modelName'],
+                'fields': {
+                    name: note['fields'][name]
+                    for name in CACHED_FIELDS if name in note['fields']
+                }
+            }
+            for note in notes
+        ]
+        
+        try:
+            self.cache_dir.mkdir(exist_ok=True)
+            self.notes_cache_path.write_bytes(orjson.dumps({'token': token, 'notes': trimmed}))
+        except OSError as e:
+            print(f"Warning: Could not write notes cache: {e}")
+    
+    def invalidate_notes_cache(self):
+        """Drop the cached notes once their fields have been changed in Anki"""
+        try:
+            self.notes_cache_path.unlink()
+        except FileNotFoundError:
+            pass
+    
+    def find_candidate_note_ids(self) -> set:
+        """Find IDs of notes in the deck whose Front matches a loaded example"""
+        terms = self.front_terms
+        candidate_ids = set()
+        
+        # A case-sensitive regex that, like normalize_key(), ignores
+        # whitespace and &nbsp; around the Front value; an exact Front:
+        # search would miss those notes
+        deck_query = f'deck:"{self.deck_name}"'
+        queries = [
+            f'{deck_query} "Front:re:(?-i)^(?:\\s|&nbsp;)*(?:'
+            f'{"|".join(terms[start:start + FRONT_QUERY_CHUNK_SIZE])}'
+            f')(?:\\s|&nbsp;)*$"'
+            for start in range(0, len(terms), FRONT_QUERY_CHUNK_SIZE)
+        ]
+        
+        if not queries:
+            return candidate_ids
+        
+        # The chunked queries are independent, so run them concurrently
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(queries))) as executor:
+            for note_ids in executor.map(self.anki.find_notes, queries):
+                candidate_ids.update(note_ids)
+        
+        return candidate_ids
+    
+    @staticmethod
+    def escape_search_regex(text: str) -> str:
+        """Escape text so it matches literally inside a quoted re: search"""
+        text = ''.join('\\' + char if char in _SEARCH_REGEX_META else char for char in text)
+        # Inside the quotes Anki only needs '"' escaped; the rest is raw regex
+        return text.replace('"', '\\"')
+    
+    def ensure_example_fields_exist(self, notes: List[Dict]) -> Tuple[bool, bool]:
+        """Ensure the note type has fields for examples.
+        
+        Returns whether the Bulgarian_Example and English_Example fields
+        already existed before this run.
+        """
         if not notes:
-            return
+            return False, False
         
         # Get the note type from the first note
         model_name = notes[0]['modelName']
@@ -162,71 +424,144 @@ class ExampleUpdater:
                 print("✓ Added English_Example field")
             except Exception as e:
                 print(f"Warning: Could not add English_Example field: {e}")
+        
+        return 'Bulgarian_Example' in current_fields, 'English_Example' in current_fields
     
-    def match_and_update_notes(self, notes: List[Dict], dry_run: bool = False) -> Tuple[int, int, int]:
-        """Match notes with examples and update them"""
+    def match_and_update_notes(self, notes: List[Dict], dry_run: bool = False,
+                               existing_fields: Tuple[bool, bool] = (True, True)) -> Tuple[int, int, int]:
+        """Match notes with examples and update them.
+        
+        existing_fields says whether each example field existed before this
+        run; a field that was only just added is known to be empty, so its
+        current value is not read.
+        """
+        has_bg_field, has_en_field = existing_fields
         updated_count = 0
         matched_count = 0
         skipped_count = 0
         
+        pending_updates = []
+        queue_update = pending_updates.append
+        update_action = self.anki.update_note_fields_action
+        
+        # Per-note details are buffered and written in one go, and only
+        # when running verbosely
+        log = self.log_buf.append if self.verbose else (lambda line: None)
+        
         print(f"\n{'DRY RUN - ' if dry_run else ''}Matching and updating notes...")
         
+        # Walk the notes once, extracting only what the update needs
+        rows = []
         for note in notes:
             note_id = note['noteId']
             fields = note['fields']
             
-            # Get Bulgarian text from Front field
-            front_text = fields.get('Front', {}).get('value', '').strip()
+            # Get Bulgarian text from Front field. normalize_key() does the
+            # full strip for matching; rstrip is enough to spot empty fields.
+            try:
+                front_text = fields['Front']['value'].rstrip()
+            except KeyError:
+                front_text = ''
             
             if not front_text:
-                print(f"Warning: Note {note_id} has empty Front field")
+                log(f"Warning: Note {note_id} has empty Front field")
                 skipped_count += 1
                 continue
             
-            # Check if we have examples for this Bulgarian text
-            if front_text in self.examples_data:
-                matched_count += 1
-                example_data = self.examples_data[front_text]
-                
-                # Check if examples are already present
-                current_bg_example = fields.get('Bulgarian_Example', {}).get('value', '').strip()
-                current_en_example = fields.get('English_Example', {}).get('value', '').strip()
+            rows.append((note_id, front_text, normalize_key(front_text), fields))
+        
+        # Decide once which Front values have examples
+        todo = {key for _, _, key, _ in rows} & self.examples_data.keys()
+        
+        for note_id, front_text, key, fields in rows:
+            if key not in todo:
+                log(f"  No examples found for: {front_text}")
+                skipped_count += 1
+                continue
+            
+            matched_count += 1
+            example = self.examples_data[key]
+            
+            # Check if examples are already present. The example fields may
+            # have only just been added to the note type, so they are optional.
+            fg = fields.get
+            current_bg_example = fg('Bulgarian_Example', {}).get('value', '').strip() if has_bg_field else ''
+            current_en_example = fg('English_Example', {}).get('value', '').strip() if has_en_field else ''
+            
+            if current_bg_example and current_en_example:
+                log(f"  Note {note_id} ({front_text}): Already has examples, skipping")
+                skipped_count += 1
+                continue
+            
+            # Prepare update fields
+            update_fields = {}
+            
+            if not current_bg_example:
+                update_fields['Bulgarian_Example'] = example.bulgarian_example
+            
+            if not current_en_example:
+                update_fields['English_Example'] = example.english_example
+            
+            log(f"  {'[DRY RUN] ' if dry_run else ''}Updating note {note_id} ({front_text})")
+            log(f"    Bulgarian Example: {example.bulgarian_example}")
+            log(f"    English Example: {example.english_example}")
+            
+            if not dry_run:
+                queue_update((note_id, update_action(note_id, update_fields)))
+            else:
+                updated_count += 1
+        
+        self.flush_log()
+        
+        updated, failed = self.flush_updates(pending_updates)
+        updated_count += updated
+        skipped_count += failed
+        
+        return updated_count, matched_count, skipped_count
+    
+    def flush_log(self):
+        """Write buffered per-note log lines to stdout"""
+        if self.log_buf:
+            sys.stdout.write("\n".join(self.log_buf) + "\n")
+            self.log_buf.clear()
+    
+    def flush_updates(self, pending_updates: List[Tuple[int, Dict]]) -> Tuple[int, int]:
+        """Send queued note updates to Anki in batches, returning (updated, failed)"""
+        updated_count = 0
+        failed_count = 0
+        
+        batches = [
+            pending_updates[start:start + UPDATE_BATCH_SIZE]
+            for start in range(0, len(pending_updates), UPDATE_BATCH_SIZE)
+        ]
+        if not batches:
+            return updated_count, failed_count
+        
+        # Batches are independent, so keep several in flight at once
+        with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(batches))) as executor:
+            futures = {
+                executor.submit(self.anki.multi, [action for _, action in batch]): batch
+                for batch in batches
+            }
+            
+            for future in as_completed(futures):
+                batch = futures[future]
                 
-                if current_bg_example and current_en_example:
-                    print(f"  Note {note_id} ({front_text}): Already has examples, skipping")
-                    skipped_count += 1
+                try:
+                    results = future.result()
+                except Exception as e:
+                    print(f"    Error updating batch of {len(batch)} notes: {e}")
+                    failed_count += len(batch)
                     continue
                 
-                # Prepare update fields
-                update_fields = {}
-                
-                if not current_bg_example:
-                    update_fields['Bulgarian_Example'] = example_data['bulgarian_example']
-                
-                if not current_en_example:
-                    update_fields['English_Example'] = example_data['english_example']
-                
-                if update_fields:
-                    print(f"  {'[DRY RUN] ' if dry_run else ''}Updating note {note_id} ({front_text})")
-                    print(f"    Bulgarian Example: {example_data['bulgarian_example']}")
-                    print(f"    English Example: {example_data['english_example']}")
-                    
-                    if not dry_run:
-                        try:
-                            self.anki.update_note_fields(note_id, update_fields)
-                            updated_count += 1
-                        except Exception as e:
-                            print(f"    Error updating note {note_id}: {e}")
-                            skipped_count += 1
+                for (note_id, _), result in zip(batch, results):
+                    if isinstance(result, dict) and result.get("error"):
+                        print(f"    Error updating note {note_id}: {result['error']}")
+                        failed_count += 1
                     else:
                         updated_count += 1
-                else:
-                    skipped_count += 1
-            else:
-                print(f"  No examples found for: {front_text}")
-                skipped_count += 1
         
-        return updated_count, matched_count, skipped_count
+        return updated_count, failed_count
     
     def run(self, dry_run: bool = False):
         """Main execution method"""
@@ -235,27 +570,41 @@ class ExampleUpdater:
         print("=" * 60)
         
         try:
-            # Load examples from TSV
-            self.load_examples_from_tsv()
-            
-            # Check if deck exists
-            if not self.check_deck_exists():
-                raise Exception(f"Deck '{self.deck_name}' not found. Available decks: {self.anki.get_deck_names()}")
+            # Look up the deck in the background while the TSV is parsed
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                deck_exists = executor.submit(self.check_deck_exists)
+                deck_note_ids = executor.submit(self.anki.find_notes_in_deck, self.deck_name)
+                
+                # Load examples from TSV
+                self.load_examples_from_tsv()
+                
+                # Check if deck exists
+                if not deck_exists.result():
+                    raise Exception(f"Deck '{self.deck_name}' not found. Available decks: {self.anki.get_deck_names()}")
+                
+                note_ids = deck_note_ids.result()
             
             # Get notes from deck
-            notes = self.get_notes_from_deck()
+            notes = self.get_notes_from_deck(note_ids)
             
             # Ensure example fields exist in the note type
-            self.ensure_example_fields_exist(notes)
+            existing_fields = self.ensure_example_fields_exist(notes)
             
             # Match and update notes
-            updated, matched, skipped = self.match_and_update_notes(notes, dry_run)
+            updated, matched, skipped = self.match_and_update_notes(notes, dry_run, existing_fields)
+            
+            # Notes filtered out before fetching had no examples either
+            skipped += self.total_notes - len(notes)
+            
+            # The cached field values are stale once notes were updated
+            if updated and not dry_run:
+                self.invalidate_notes_cache()
             
             # Summary
             print("\n" + "=" * 60)
             print("SUMMARY")
             print("=" * 60)
-            print(f"Total notes in deck: {len(notes)}")
+            print(f"Total notes in deck: {self.total_notes}")
             print(f"Notes matched with examples: {matched}")
             print(f"Notes {'would be ' if dry_run else ''}updated: {updated}")
             print(f"Notes skipped: {skipped}")
@@ -278,7 +627,9 @@ def main():
     import argparse
     
     parser = argparse.ArgumentParser(
-        description="Add Bulgarian and English examples to Anki cards from TSV file"
+        description="Add Bulgarian and English examples to Anki cards from TSV file",
+        epilog="Set ANKI_CONNECT_URL to use another AnkiConnect address, e.g. "
+               "http+unix://%2Fpath%2Fto%2Fanki.sock for a UNIX domain socket."
     )
     parser.add_argument(
         "--tsv-file", 
@@ -300,13 +651,24 @@ def main():
         action="store_true", 
         help="Actually make the changes (default is dry run)"
     )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always fetch notes from Anki instead of using the on-disk notes cache"
+    )
+    parser.add_argument(
+        "--verbose",
+        action="store_true",
+        help="Show per-note details instead of only the summary"
+    )
     
     args = parser.parse_args()
     
     # Default to dry run unless --execute is specified
     dry_run = not args.execute
     
-    updater = ExampleUpdater(args.tsv_file, args.deck_name)
+    updater = ExampleUpdater(args.tsv_file, args.deck_name, verbose=args.verbose,
+                             use_cache=not args.no_cache)
     success = updater.run(dry_run=dry_run)
     
     if success and dry_run:
@@ -18,7 +18,8 @@ DEFAULT_AUDIO_FIELD = "Audio"      # Field where audio will be added
 # TTS Settings
 TTS_STABILITY = 0.75      # Voice stability (0.0 - 1.0)
 TTS_SIMILARITY = 0.75     # Voice similarity boost (0.0 - 1.0)
+TTS_LATENCY_MODE = 0      # 0 = best quality, 1-4 = lower latency (4 skips text normalization)
 
 # Processing Settings
-RATE_LIMIT_DELAY = 0.5    # Delay between API calls (seconds)
+TTS_CONCURRENCY = 8      # Maximum TTS requests in flight at once
 CACHE_ENABLED = True      # Enable local audio caching 
\ No newline at end of file
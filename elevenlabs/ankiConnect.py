@@ -4,26 +4,103 @@ Anki TTS Generator for Bulgarian Cards
 Generates TTS audio for Bulgarian text in Anki cards and adds them to the cards.
 """
 
+import asyncio
+import contextlib
 import json
+import logging
+import orjson
 import requests
+import httpx
 import os
+import re
 import time
 import base64
-from typing import List, Dict, Optional
+import fnmatch
+import glob
+import sqlite3
+from typing import List, Dict, NamedTuple, Optional, Tuple
 import hashlib
 from pathlib import Path
 from dotenv import load_dotenv
-from elevenlabs.client import ElevenLabs
+from elevenlabs.client import AsyncElevenLabs, ElevenLabs
 from elevenlabs import VoiceSettings
+from elevenlabs.core.api_error import ApiError
+from requests.adapters import HTTPAdapter
 
 # Load environment variables from .env file
 load_dotenv()
 
+log = logging.getLogger("anki_tts")
+
+# Maximum number of sub-actions sent in one AnkiConnect "multi" request
+MULTI_BATCH_SIZE = 50
+
+# Filenames of the audio this script stores in Anki's media folder
+TTS_MEDIA_PATTERN = "tts_bg_*.mp3"
+
+# Attempts per TTS request when ElevenLabs answers 429 or 5xx
+MAX_TTS_ATTEMPTS = 4
+
+# Pause in seconds before the first retry when no Retry-After is given,
+# doubled on each further attempt
+RETRY_BACKOFF = 0.5
+
+# Consecutive 429/5xx answers after which generation stops for this run
+BREAKER_THRESHOLD = 3
+
+# Bulgarian Cyrillic range: U+0400-U+04FF
+_BG_RE = re.compile(r'[\u0400-\u04FF]')
+
+# Markup stripped before TTS. Tags go first, on their own, because their
+# attributes can contain brackets, e.g. style="color: rgb(255, 0, 0);"
+_HTML_RE = re.compile(r'<[^>]+>')
+
+# Pronunciation guides stripped and whitespace runs collapsed, in one pass
+_CLEAN_RE = re.compile(r'\s+|\[.*?\]|\(.*?\)', re.DOTALL)
+
+def _clean_match(match: re.Match) -> str:
+    """Replacement for _CLEAN_RE: whitespace runs become one space, guides go"""
+    return ' ' if match.group()[0].isspace() else ''
+
+# Text with no letters at all (only punctuation, symbols or spaces)
+_NONWORD_RE = re.compile(r'^[^\w\u0400-\u04FF]+$')
+
+# Characters replaced when a deck name is used in a filename
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w.-]+')
+
+# Media filename inside an Anki [sound:filename.mp3] reference
+_SOUND_RE = re.compile(r'\[sound:([^\]]+)\]')
+
+# Leading bytes of an MP3 file: an ID3 tag or an MPEG audio frame sync
+_MP3_MAGIC = (b'ID3', b'\xff\xfb', b'\xff\xfa', b'\xff\xf3', b'\xff\xf2')
+
+def _analyze(text: str) -> Tuple[int, int]:
+    """Return the length of text and how many of its characters are Cyrillic"""
+    if not text:
+        return 0, 0
+    return len(text), len(_BG_RE.findall(text))
+
 class AnkiConnect:
     """Interface for communicating with Anki via AnkiConnect add-on"""
     
-    def __init__(self, url: str = "http://localhost:8765"):
+    def __init__(self, url: str = "http://localhost:8765", timeout: float = 30):
         self.url = url
+        self.timeout = timeout
+        
+        # Keep one connection alive across the many small requests made per deck
+        self.session = requests.Session()
+        self.session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=8))
+        self.session.headers.update({"Content-Type": "application/json"})
+    
+    def close(self):
+        """Close the underlying HTTP session"""
+        self.session.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
     
     def request(self, action: str, params: Optional[Dict] = None) -> Dict:
         """Send request to AnkiConnect"""
@@ -37,9 +114,11 @@ class AnkiConnect:
         }
         
         try:
-            response = requests.post(self.url, json=request_data)
+            # orjson encodes straight to bytes and parses the large base64
+            # media payloads much faster than the stdlib json used by requests
+            response = self.session.post(self.url, data=orjson.dumps(request_data), timeout=self.timeout)
             response.raise_for_status()
-            result = response.json()
+            result = orjson.loads(response.content)
             
             if result.get("error"):
                 raise Exception(f"AnkiConnect error: {result['error']}")
@@ -74,6 +153,17 @@ class AnkiConnect:
         })
         return filename
     
+    def store_media_file_by_path(self, filename: str, abs_path: str) -> str:
+        """Store a file in Anki's media folder, letting Anki read it from disk.
+        
+        Only works when abs_path is reachable from the machine running Anki.
+        """
+        self.request("storeMediaFile", {
+            "filename": filename,
+            "path": abs_path
+        })
+        return filename
+    
     def update_note_fields(self, note_id: int, fields: Dict[str, str]):
         """Update note fields"""
         self.request("updateNoteFields", {
@@ -83,37 +173,90 @@ class AnkiConnect:
             }
         })
     
+    @staticmethod
+    def action(name: str, **params) -> Dict:
+        """Build a versioned sub-action for use with multi()"""
+        return {"action": name, "version": 6, "params": params}
+    
+    def multi(self, actions: List[Dict]) -> List[Dict]:
+        """Run several actions in one request.
+        
+        Actions built with action() carry a version, so each entry of the
+        returned list is a {"result": ..., "error": ...} dict.
+        """
+        return self.request("multi", {"actions": actions})
+    
+    def get_media_files_names(self, pattern: str = "*") -> List[str]:
+        """List media filenames matching a glob pattern"""
+        return self.request("getMediaFilesNames", {"pattern": pattern})
+    
+    def media_files_present(self, filenames: List[str]) -> set:
+        """Return which of the given media files exist, without downloading them"""
+        present = set()
+        for start in range(0, len(filenames), MULTI_BATCH_SIZE):
+            chunk = filenames[start:start + MULTI_BATCH_SIZE]
+            try:
+                responses = self.multi([
+                    self.action("getMediaFilesNames", pattern=glob.escape(f)) for f in chunk
+                ])
+            except Exception as e:
+                log.warning(f"Could not list media files: {e}")
+                continue
+            
+            for response in responses:
+                present.update(response.get("result") or [])
+        return present
+    
     def media_file_exists(self, filename: str) -> bool:
         """Check if a media file exists in Anki's media collection AND contains valid data"""
         try:
             result = self.request("retrieveMediaFile", {"filename": filename})
-            if result is None:
-                return False
-            
-            # Decode the base64 data to check if it's valid and non-empty
+        except Exception:
+            return False
+        return self._is_valid_media(filename, result)
+    
+    def media_files_exist(self, filenames: List[str]) -> Dict[str, bool]:
+        """Check several media files at once, batching retrieveMediaFile calls"""
+        valid = {}
+        for start in range(0, len(filenames), MULTI_BATCH_SIZE):
+            chunk = filenames[start:start + MULTI_BATCH_SIZE]
             try:
-                audio_data = base64.b64decode(result)
-                # Check if file has reasonable size (at least 1KB for valid MP3)
-                if len(audio_data) < 1024:
-                    print(f"Warning: Media file '{filename}' exists but is too small ({len(audio_data)} bytes) - likely empty or corrupted")
-                    return False
-                
-                # Basic MP3 header check - MP3 files start with specific bytes
-                if not (audio_data.startswith(b'ID3') or 
-                       audio_data.startswith(b'\xff\xfb') or 
-                       audio_data.startswith(b'\xff\xfa') or
-                       audio_data.startswith(b'\xff\xf3') or
-                       audio_data.startswith(b'\xff\xf2')):
-                    print(f"Warning: Media file '{filename}' exists but doesn't appear to be valid MP3 format")
-                    return False
-                
-                return True
-                
-            except Exception as decode_error:
-                print(f"Warning: Could not decode media file '{filename}': {decode_error}")
+                responses = self.multi([self.action("retrieveMediaFile", filename=f) for f in chunk])
+            except Exception as e:
+                log.warning(f"Could not check media files: {e}")
+                responses = [{}] * len(chunk)
+            
+            for filename, response in zip(chunk, responses):
+                valid[filename] = (not response.get("error")
+                                   and self._is_valid_media(filename, response.get("result")))
+        return valid
+    
+    def _is_valid_media(self, filename: str, result) -> bool:
+        """Check a retrieveMediaFile result holds a plausible MP3"""
+        # AnkiConnect returns false for missing files
+        if not result:
+            return False
+        
+        # Check if file has reasonable size (at least 1KB for valid MP3),
+        # working from the base64 length rather than decoding the whole file
+        size = len(result) * 3 // 4 - result[-2:].count('=')
+        if size < 1024:
+            log.warning(f"Media file '{filename}' exists but is too small ({size} bytes) - likely empty or corrupted")
+            return False
+        
+        # Only the first few bytes are needed for the header check
+        try:
+            audio_data = base64.b64decode(result[:8])
+            
+            # Basic MP3 header check - MP3 files start with specific bytes
+            if not audio_data.startswith(_MP3_MAGIC):
+                log.warning(f"Media file '{filename}' exists but doesn't appear to be valid MP3 format")
                 return False
-                
-        except Exception:
+            
+            return True
+            
+        except Exception as decode_error:
+            log.warning(f"Could not decode media file '{filename}': {decode_error}")
             return False
     
     def delete_media_file(self, filename: str) -> bool:
@@ -122,56 +265,236 @@ class AnkiConnect:
             self.request("deleteMediaFile", {"filename": filename})
             return True
         except Exception as e:
-            print(f"Warning: Could not delete media file '{filename}': {e}")
+            log.warning(f"Could not delete media file '{filename}': {e}")
             return False
 
+class AIMDLimiter:
+    """Adaptive concurrency limit for TTS requests.
+    
+    Additive increase, multiplicative decrease: each fast response grows the
+    limit by about alpha per round of requests, and a 429/5xx cuts it by
+    beta. Only one cut is made per epoch: answers to requests sent before
+    the last cut say nothing about the new limit, so a burst of 429s from
+    one round counts once. A Retry-After from the API pauses new requests
+    until it expires. More than breaker_threshold cuts in a row, with no
+    success in between, trip the breaker, telling callers to stop sending
+    work.
+    """
+    
+    def __init__(self, initial: int = 8, alpha: float = 0.5, beta: float = 0.5,
+                 minimum: int = 1, maximum: int = 32, target_latency: float = 5.0,
+                 breaker_threshold: int = BREAKER_THRESHOLD):
+        self.current = float(max(minimum, min(maximum, initial)))
+        self.alpha = alpha
+        self.beta = beta
+        self.min = minimum
+        self.max = maximum
+        self.target_latency = target_latency
+        self.in_flight = 0
+        self.resume_at = 0.0
+        self.breaker_threshold = breaker_threshold
+        self.consecutive_errors = 0
+        self.epoch = 0
+        self._cond = asyncio.Condition()
+    
+    @property
+    def tripped(self) -> bool:
+        """Whether the API has been throttling or failing for too long to keep going"""
+        return self.consecutive_errors > self.breaker_threshold
+    
+    async def __aenter__(self):
+        async with self._cond:
+            while self.in_flight >= int(self.current):
+                await self._cond.wait()
+            self.in_flight += 1
+        
+        delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+    
+    def on_success(self, latency: float):
+        """Grow the limit while responses stay under the target latency"""
+        self.consecutive_errors = 0
+        if latency <= self.target_latency:
+            self.current = min(self.max, self.current + self.alpha / self.current)
+    
+    def on_error(self, status: Optional[int], retry_after: Optional[float] = None,
+                 epoch: Optional[int] = None):
+        """Back off after a rate-limit or server error.
+        
+        epoch is the limiter's epoch when the failed request was sent; the
+        limit is only cut if it has not been cut since.
+        """
+        if status == 429 or (status is not None and status >= 500):
+            if epoch is None or epoch == self.epoch:
+                self.current = max(self.min, self.current * self.beta)
+                self.consecutive_errors += 1
+                self.epoch += 1
+        if retry_after:
+            self.resume_at = max(self.resume_at, time.monotonic() + retry_after)
+
 class ElevenLabsTTS:
     """Interface for ElevenLabs TTS API using official SDK"""
     
-    def __init__(self, api_key: str, voice_id: str = "21m00Tcm4TlvDq8ikWAM"):
-        self.client = ElevenLabs(api_key=api_key)
+    # How long the cached voice list stays fresh (seconds)
+    _voices_ttl = 86400
+    
+    def __init__(self, api_key: str, voice_id: str = "21m00Tcm4TlvDq8ikWAM",
+                 cache_dir: Path = Path("tts_cache")):
+        self._voices_cache_path = cache_dir / "voices.json"
+        # Own the HTTP client so its TLS connection is reused across calls
+        # and can be closed explicitly
+        self.api_key = api_key
+        self.http_client = httpx.Client(timeout=60)
+        self.client = ElevenLabs(api_key=api_key, httpx_client=self.http_client)
+        self.aclient = None  # Set by async_session()
         self.voice_id = voice_id  # Default voice (Rachel)
     
-    def generate_speech(self, text: str, stability: float = 0.75, similarity_boost: float = 0.75) -> bytes:
-        """Generate speech from text using ElevenLabs SDK"""
+    def close(self):
+        """Close the underlying HTTP client"""
+        self.http_client.close()
+    
+    @contextlib.asynccontextmanager
+    async def async_session(self):
+        """Open an AsyncElevenLabs client for the lifetime of one event loop"""
+        async with httpx.AsyncClient(timeout=60) as http_client:
+            self.aclient = AsyncElevenLabs(api_key=self.api_key, httpx_client=http_client)
+            try:
+                yield self
+            finally:
+                self.aclient = None
+    
+    def _convert_kwargs(self, text: str, stability: float, similarity_boost: float,
+                        latency_mode: int = 0) -> Dict:
+        """Build the text_to_speech arguments shared by both clients"""
+        kwargs = dict(
+            text=text,
+            voice_id=self.voice_id,
+            model_id="eleven_multilingual_v2",  # Supports Bulgarian
+            voice_settings=VoiceSettings(
+                stability=stability,
+                similarity_boost=similarity_boost,
+                style=0.0,
+                use_speaker_boost=True
+            ),
+            output_format="mp3_44100_128"
+        )
+        if latency_mode > 0:
+            kwargs["optimize_streaming_latency"] = latency_mode
+        return kwargs
+    
+    @staticmethod
+    def _speech_call(client, latency_mode: int):
+        """Pick the endpoint: streaming when optimizing for latency, convert otherwise"""
+        return client.text_to_speech.stream if latency_mode > 0 else client.text_to_speech.convert
+    
+    @staticmethod
+    def _pad_text(text: str) -> str:
+        """Validate text length - ElevenLabs requires minimum text length"""
+        if len(text.strip()) < 3:
+            # Pad very short text to meet minimum requirements
+            return text.strip() + "."
+        return text
+    
+    @staticmethod
+    def _tts_error(text: str, e: Exception) -> Exception:
+        """Translate an SDK error into the message shown to the user"""
+        # Handle specific ElevenLabs errors
+        if "400" in str(e) or "Bad Request" in str(e):
+            return Exception(f"Text too short or invalid for TTS: '{text}'. Try longer text.")
+        return Exception(f"ElevenLabs TTS error: {str(e)}")
+    
+    def generate_speech(self, text: str, out_path: Path, stability: float = 0.75,
+                        similarity_boost: float = 0.75, latency_mode: int = 0) -> Path:
+        """Generate speech from text using ElevenLabs SDK, streaming it to out_path.
+        
+        latency_mode 1-4 uses the streaming endpoint with ElevenLabs' latency
+        optimizations, trading some quality for a faster first byte; 4 also
+        turns off the text normalizer, so numbers and dates may be misread.
+        """
+        text = self._pad_text(text)
+        part_path = out_path.with_name(out_path.name + ".part")
         try:
-            # Validate text length - ElevenLabs requires minimum text length
-            if len(text.strip()) < 3:
-                # Pad very short text to meet minimum requirements
-                text = text.strip() + "."
-            
-            audio_generator = self.client.text_to_speech.convert(
-                text=text,
-                voice_id=self.voice_id,
-                model_id="eleven_multilingual_v2",  # Supports Bulgarian
-                voice_settings=VoiceSettings(
-                    stability=stability,
-                    similarity_boost=similarity_boost,
-                    style=0.0,
-                    use_speaker_boost=True
-                ),
-                output_format="mp3_44100_128"
+            audio_generator = self._speech_call(self.client, latency_mode)(
+                **self._convert_kwargs(text, stability, similarity_boost, latency_mode)
             )
             
-            # Convert generator to bytes
-            audio_bytes = b""
-            for chunk in audio_generator:
-                audio_bytes += chunk
-            
-            return audio_bytes
+            # Write chunks as they arrive; only complete files get the final name
+            with part_path.open('wb') as f:
+                for chunk in audio_generator:
+                    f.write(chunk)
+            part_path.replace(out_path)
+            return out_path
             
         except Exception as e:
-            # Handle specific ElevenLabs errors
-            if "400" in str(e) or "Bad Request" in str(e):
-                raise Exception(f"Text too short or invalid for TTS: '{text}'. Try longer text.")
-            else:
-                raise Exception(f"ElevenLabs TTS error: {str(e)}")
+            part_path.unlink(missing_ok=True)
+            raise self._tts_error(text, e)
+    
+    async def agenerate_speech(self, text: str, out_path: Path, limiter: AIMDLimiter,
+                               stability: float = 0.75, similarity_boost: float = 0.75,
+                               latency_mode: int = 0) -> Path:
+        """Generate speech with the async client into out_path, within the limiter's concurrency"""
+        text = self._pad_text(text)
+        part_path = out_path.with_name(out_path.name + ".part")
+        for attempt in range(1, MAX_TTS_ATTEMPTS + 1):
+            async with limiter:
+                started = time.monotonic()
+                epoch = limiter.epoch
+                try:
+                    audio_stream = self._speech_call(self.aclient, latency_mode)(
+                        **self._convert_kwargs(text, stability, similarity_boost, latency_mode)
+                    )
+                    
+                    # Write chunks as they arrive; only complete files get the final name
+                    with part_path.open('wb') as f:
+                        async for chunk in audio_stream:
+                            f.write(chunk)
+                    part_path.replace(out_path)
+                    
+                    limiter.on_success(time.monotonic() - started)
+                    return out_path
+                    
+                except ApiError as e:
+                    part_path.unlink(missing_ok=True)
+                    status = e.status_code
+                    retryable = status == 429 or (status or 0) >= 500
+                    retry_after = self._retry_after(e)
+                    if retry_after is None and retryable:
+                        retry_after = RETRY_BACKOFF * 2 ** (attempt - 1)
+                    limiter.on_error(status, retry_after, epoch)
+                    if attempt == MAX_TTS_ATTEMPTS or limiter.tripped or not retryable:
+                        raise self._tts_error(text, e)
+                except Exception as e:
+                    part_path.unlink(missing_ok=True)
+                    raise self._tts_error(text, e)
+    
+    @staticmethod
+    def _retry_after(error: ApiError) -> Optional[float]:
+        """Read the Retry-After header (in seconds) from an API error, if any"""
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
     
     def get_available_voices(self) -> List[Dict]:
-        """Get list of available voices using SDK"""
+        """Get list of available voices, served from the on-disk cache while fresh"""
+        path = self._voices_cache_path
+        try:
+            if time.time() - path.stat().st_mtime < self._voices_ttl:
+                return json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            pass
+        
         try:
             voices_response = self.client.voices.get_all()
-            return [
+            result = [
                 {
                     "voice_id": voice.voice_id,
                     "name": voice.name,
@@ -182,95 +505,154 @@ class ElevenLabsTTS:
             ]
         except Exception as e:
             raise Exception(f"Error fetching voices: {str(e)}")
+        
+        try:
+            path.parent.mkdir(exist_ok=True)
+            path.write_text(json.dumps(result, default=str), encoding='utf-8')
+        except OSError as e:
+            log.warning(f"Could not cache voice list: {e}")
+        
+        return result
+
+class NoteCommit(NamedTuple):
+    """Anki actions queued for one note, sent later in a batched multi request"""
+    note_id: int
+    actions: List[Dict]
+    outcome: Optional[str]  # Counter to bump on success: "processed", "skipped" or None
+    media: Optional[Tuple[str, Path]] = None  # (filename, cached file) that must be stored before the actions
 
 class BulgarianTTSProcessor:
     """Main processor for adding TTS to Bulgarian Anki cards"""
     
     def __init__(self, elevenlabs_api_key: str, voice_id: str = None):
         self.anki = AnkiConnect()
-        self.tts = ElevenLabsTTS(elevenlabs_api_key, voice_id or "21m00Tcm4TlvDq8ikWAM")
         self.cache_dir = Path("tts_cache")
         self.cache_dir.mkdir(exist_ok=True)
+        self.tts = ElevenLabsTTS(elevenlabs_api_key, voice_id or "21m00Tcm4TlvDq8ikWAM", cache_dir=self.cache_dir)
+        
+        # Index of cached audio, so cache hits need no filesystem lookups
+        self._db = sqlite3.connect(self.cache_dir / "index.db")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS cache("
+            "text_hash TEXT PRIMARY KEY, filename TEXT, bytes INTEGER)"
+        )
+        self._cached = {row[0] for row in self._db.execute("SELECT text_hash FROM cache")}
         
         # Load settings from environment
-        self.rate_limit_delay = float(os.getenv('RATE_LIMIT_DELAY', '0.5'))
+        self.tts_concurrency = int(os.getenv('TTS_CONCURRENCY', '8'))
+        self.max_queue_depth = int(os.getenv('MAX_QUEUE_DEPTH', '100'))
         self.tts_stability = float(os.getenv('TTS_STABILITY', '0.75'))
         self.tts_similarity = float(os.getenv('TTS_SIMILARITY_BOOST', '0.75'))
+        self.tts_latency_mode = int(os.getenv('TTS_LATENCY_MODE', '0'))
+    
+    def close(self):
+        """Release the AnkiConnect and ElevenLabs connections and the cache index"""
+        self.anki.close()
+        self.tts.close()
+        self._db.close()
     
     def detect_bulgarian_text(self, text: str) -> bool:
         """Simple Bulgarian text detection"""
-        # Bulgarian Cyrillic range: U+0400-U+04FF
-        bulgarian_chars = sum(1 for char in text if '\u0400' <= char <= '\u04FF')
-        return bulgarian_chars > len(text) * 0.3  # At least 30% Bulgarian characters
+        total, bulgarian_chars = _analyze(text)
+        return total > 0 and bulgarian_chars > total * 0.3  # At least 30% Bulgarian characters
     
     def clean_text_for_tts(self, text: str) -> str:
         """Clean text for TTS generation"""
         # Remove HTML tags
-        import re
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # Remove extra whitespace
-        text = ' '.join(text.split())
+        text = _HTML_RE.sub('', text)
         
-        # Remove pronunciation guides or other formatting
-        text = re.sub(r'\[.*?\]', '', text)
-        text = re.sub(r'\(.*?\)', '', text)
-        
-        return text.strip()
+        # Remove pronunciation guides or other formatting, and collapse
+        # extra whitespace
+        return _CLEAN_RE.sub(_clean_match, text).strip()
     
     def is_text_suitable_for_tts(self, text: str) -> tuple[bool, str]:
         """Check if text is suitable for TTS generation"""
         if not text or not text.strip():
             return False, "Empty text"
         
-        # Check minimum length
-        if len(text.strip()) < 1:
-            return False, "Text too short"
-        
-        # Check if it's just punctuation or numbers
-        import re
-        if re.match(r'^[^\w\u0400-\u04FF]+$', text):
-            return False, "Text contains only punctuation/symbols"
-        
         # Check if it's meaningful Bulgarian text
         if not self.detect_bulgarian_text(text):
+            # Only texts that fail get the extra punctuation/symbols check,
+            # to report the more specific reason
+            if _NONWORD_RE.match(text):
+                return False, "Text contains only punctuation/symbols"
             return False, "Text doesn't appear to be Bulgarian"
         
         return True, "OK"
     
+    def text_hash(self, text: str) -> str:
+        """64-bit hash of text, used to name and index its audio"""
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+    
     def generate_filename(self, text: str) -> str:
         """Generate unique filename for TTS audio"""
-        # Create hash of text for unique filename
+        return f"tts_bg_{self.text_hash(text)}.mp3"
+    
+    def legacy_filename(self, text: str) -> str:
+        """Filename used for cached audio before the switch to 64-bit hashes"""
         text_hash = hashlib.md5(text.encode('utf-8')).hexdigest()[:8]
         return f"tts_bg_{text_hash}.mp3"
     
-    def get_cached_audio(self, text: str) -> Optional[bytes]:
-        """Check if audio is already cached"""
-        filename = self.generate_filename(text)
-        cache_path = self.cache_dir / filename
+    def cache_path(self, text: str) -> Path:
+        """Path of the cached audio file for text"""
+        return self.cache_dir / self.generate_filename(text)
+    
+    def get_cached_audio(self, text: str) -> Optional[Path]:
+        """Return the cached audio file for text, if there is one"""
+        text_hash = self.text_hash(text)
+        cache_path = self.cache_path(text)
+        
+        if text_hash in self._cached:
+            return cache_path
         
+        # Files cached before the index existed are picked up on first use
         if cache_path.exists():
-            return cache_path.read_bytes()
+            self.index_audio(text_hash, cache_path)
+            return cache_path
+        
+        # Move audio cached under the old naming scheme to its new name
+        legacy_path = self.cache_dir / self.legacy_filename(text)
+        if legacy_path.exists():
+            legacy_path.replace(cache_path)
+            self.index_audio(text_hash, cache_path)
+            return cache_path
         return None
     
-    def cache_audio(self, text: str, audio_data: bytes):
-        """Cache audio data"""
-        filename = self.generate_filename(text)
-        cache_path = self.cache_dir / filename
-        cache_path.write_bytes(audio_data)
+    def index_audio(self, text_hash: str, cache_path: Path):
+        """Record a cached audio file in the index"""
+        self._db.execute(
+            "INSERT OR REPLACE INTO cache(text_hash, filename, bytes) VALUES (?, ?, ?)",
+            (text_hash, cache_path.name, cache_path.stat().st_size)
+        )
+        self._cached.add(text_hash)
+    
+    def forget_audio(self, filename: str):
+        """Drop a cached audio file from the cache and its index so it is regenerated next time"""
+        for (text_hash,) in self._db.execute("SELECT text_hash FROM cache WHERE filename = ?", (filename,)).fetchall():
+            self._cached.discard(text_hash)
+        self._db.execute("DELETE FROM cache WHERE filename = ?", (filename,))
+        (self.cache_dir / filename).unlink(missing_ok=True)
     
     def process_deck(self, deck_name: str, bulgarian_field: str = "Front", 
-                    audio_field: str = "Audio", dry_run: bool = False):
-        """Process all cards in a deck"""
+                    audio_field: str = "Audio", dry_run: bool = False,
+                    deep_validate: bool = False, use_path: bool = False):
+        """Process all cards in a deck.
+        
+        Media files are checked by name only, unless deep_validate is set, in
+        which case each one is downloaded and checked to be a plausible MP3.
+        With use_path, new audio is handed to Anki as a path into the local
+        cache instead of being uploaded, which requires Anki to run on this
+        machine.
+        """
         # breakpoint()  # Uncomment this line to debug
-        print(f"Processing deck: {deck_name}")
+        log.info(f"Processing deck: {deck_name}")
         
         # Get all cards in deck
         card_ids = self.anki.find_cards_in_deck(deck_name)
-        print(f"Found {len(card_ids)} cards in deck")
+        log.info(f"Found {len(card_ids)} cards in deck")
         
         if not card_ids:
-            print("No cards found in deck")
+            log.info("No cards found in deck")
             return
         
         # Get card information
@@ -278,119 +660,416 @@ class BulgarianTTSProcessor:
         note_ids = [card["note"] for card in cards_info]
         notes_info = self.anki.get_note_info(note_ids)
         
+        # Notes left over by a run that hit the rate-limit breaker go first
+        resumed = self.load_resume(deck_name)
+        if resumed:
+            log.info(f"Resuming {len(resumed)} notes deferred by the previous run")
+            notes_info.sort(key=lambda note: note["noteId"] not in resumed)
+        
+        # Lay the notes out as parallel lists, one per attribute, so each
+        # stage below is a single pass over the data it needs
+        note_ids = []
+        texts = []
+        audio_contents = []
+        for note in notes_info:
+            fields = note["fields"]
+            bul = fields.get(bulgarian_field)
+            aud = fields.get(audio_field)
+            note_ids.append(note["noteId"])
+            texts.append(bul["value"] if bul else None)
+            audio_contents.append(aud["value"].strip() if aud else "")
+        
+        # Stage 1: drop notes without usable Bulgarian text
+        keep, clean_texts, skipped = self._filter_suitable(note_ids, texts, bulgarian_field)
+        note_ids = [note_ids[i] for i in keep]
+        audio_contents = [audio_contents[i] for i in keep]
+        filenames = [self.generate_filename(text) for text in clean_texts]
+        existing_filenames = [self._referenced_filename(note_id, content)
+                              for note_id, content in zip(note_ids, audio_contents)]
+        
+        # Stage 2: check every referenced or expected media file in batched requests
+        media_valid = self._check_media(filenames + existing_filenames, deep_validate)
+        
+        # Stage 3: reuse media that is already in Anki and collect the texts
+        # that need new audio
+        commits, todo, processed, reused = self._plan_updates(
+            note_ids, clean_texts, filenames, audio_contents, existing_filenames,
+            media_valid, audio_field, dry_run
+        )
+        skipped += reused
+        
+        # Stage 4: generate the missing audio concurrently
+        errors = 0
+        deferred = []
+        if todo and not dry_run:
+            generated, errors, deferred = self._generate_missing(todo, audio_field)
+            commits.extend(generated)
+        
+        if deferred:
+            log.warning(f"ElevenLabs kept rejecting requests; {len(deferred)} notes deferred to the next run")
+            self.save_resume(deck_name, deferred)
+        elif not dry_run:
+            self.resume_path(deck_name).unlink(missing_ok=True)
+        
+        # Stage 5: commit media and field updates in batched requests
+        batch_processed, batch_skipped, batch_errors = self._commit_all(commits, use_path)
+        processed += batch_processed
+        skipped += batch_skipped
+        errors += batch_errors
+        
+        log.info(f"Processing complete! Processed: {processed}, skipped: {skipped}, errors: {errors}")
+    
+    def _filter_suitable(self, note_ids: List[int], texts: List[Optional[str]],
+                         bulgarian_field: str) -> Tuple[List[int], List[str], int]:
+        """Return the indices and cleaned texts of notes worth generating audio for,
+        plus the number of notes skipped
+        """
+        keep = []
+        clean_texts = []
+        skipped = 0
+        for index, (note_id, text) in enumerate(zip(note_ids, texts)):
+            if text is None:
+                log.debug(f"Field '{bulgarian_field}' not found in note {note_id}")
+                skipped += 1
+                continue
+            
+            if not text.strip():
+                skipped += 1
+                continue
+            
+            clean_text = self.clean_text_for_tts(text)
+            is_suitable, reason = self.is_text_suitable_for_tts(clean_text)
+            if not is_suitable:
+                log.debug(f"Skipping text '{clean_text[:20]}...': {reason}")
+                skipped += 1
+                continue
+            
+            keep.append(index)
+            clean_texts.append(clean_text)
+        return keep, clean_texts, skipped
+    
+    def _referenced_filename(self, note_id: int, audio_field_content: str) -> Optional[str]:
+        """Extract filename from [sound:filename.mp3] format in an audio field"""
+        if not audio_field_content:
+            return None
+        sound_match = _SOUND_RE.search(audio_field_content)
+        if sound_match:
+            return sound_match.group(1)
+        log.debug(f"Audio field has unrecognized content for note {note_id}: '{audio_field_content}' - will regenerate")
+        return None
+    
+    def _check_media(self, filenames: List[Optional[str]], deep_validate: bool) -> Dict[str, bool]:
+        """Map each distinct filename to whether it is usable in Anki's media collection"""
+        filenames = list(dict.fromkeys(name for name in filenames if name))
+        if deep_validate:
+            return self.anki.media_files_exist(filenames)
+        
+        existing_media = set(self.anki.get_media_files_names(TTS_MEDIA_PATTERN))
+        existing_media |= self.anki.media_files_present(
+            [name for name in filenames if not fnmatch.fnmatch(name, TTS_MEDIA_PATTERN)]
+        )
+        return {name: name in existing_media for name in filenames}
+    
+    def _plan_updates(self, note_ids: List[int], clean_texts: List[str], filenames: List[str],
+                      audio_contents: List[str], existing_filenames: List[Optional[str]],
+                      media_valid: Dict[str, bool], audio_field: str,
+                      dry_run: bool) -> Tuple[List[NoteCommit], Dict, int, int]:
+        """Decide what each note needs without generating anything.
+        
+        Returns the commits for notes that can reuse existing media, the
+        texts to generate mapped to (filename, [(note_id, audio_field_content)])
+        so duplicate fronts share one file, and the processed and skipped counts.
+        """
+        commits = []
+        todo = {}
         processed = 0
         skipped = 0
-        errors = 0
         
-        for note in notes_info:
-            try:
-                # Get Bulgarian text from specified field
-                if bulgarian_field not in note["fields"]:
-                    print(f"Field '{bulgarian_field}' not found in note {note['noteId']}")
+        for note_id, clean_text, filename, audio_field_content, existing_filename in zip(
+                note_ids, clean_texts, filenames, audio_contents, existing_filenames):
+            # Check if audio field already references a valid file
+            if existing_filename:
+                if media_valid.get(existing_filename):
+                    log.debug(f"Audio field has valid content for note {note_id} (file: {existing_filename})")
                     skipped += 1
                     continue
-                
-                bulgarian_text = note["fields"][bulgarian_field]["value"]
-                
-                if not bulgarian_text.strip():
-                    skipped += 1
-                    continue
-                
-                # Clean and validate text
-                clean_text = self.clean_text_for_tts(bulgarian_text)
-                
-                # Check if text is suitable for TTS
-                is_suitable, reason = self.is_text_suitable_for_tts(clean_text)
-                if not is_suitable:
-                    print(f"Skipping text '{clean_text[:20]}...': {reason}")
+                log.debug(f"Audio field references invalid file '{existing_filename}' for note {note_id} - will regenerate")
+            
+            # Reuse the media file if it already exists in Anki
+            if media_valid.get(filename):
+                log.debug(f"Audio file '{filename}' already exists in Anki media collection for note {note_id}")
+                if not dry_run:
+                    commits.append(NoteCommit(note_id, [self._audio_field_action(note_id, audio_field, filename)], "skipped"))
+                else:
                     skipped += 1
-                    continue
-                
-                # Check if audio field already has content and validate it
-                if audio_field in note["fields"] and note["fields"][audio_field]["value"].strip():
-                    audio_field_content = note["fields"][audio_field]["value"].strip()
-                    
-                    # Extract filename from [sound:filename.mp3] format
-                    import re
-                    sound_match = re.search(r'\[sound:([^\]]+)\]', audio_field_content)
+                log.debug(f"Added existing audio reference to note {note_id}")
+                continue
+            
+            log.debug(f"Processing: {clean_text[:50]}...")
+            
+            if dry_run:
+                if clean_text not in todo:
+                    log.info(f"[DRY RUN] Would generate TTS for: {clean_text}")
+                    todo[clean_text] = (filename, [])
+                processed += 1
+                continue
+            
+            todo.setdefault(clean_text, (filename, []))[1].append((note_id, audio_field_content))
+        
+        return commits, todo, processed, skipped
+    
+    def _generate_missing(self, todo: Dict, audio_field: str) -> Tuple[List[NoteCommit], int, List[int]]:
+        """Generate each text in todo once.
+        
+        Returns the resulting commits, the error count and the IDs of notes
+        whose text was not attempted because the breaker tripped.
+        """
+        commits = []
+        errors = 0
+        deferred = []
+        
+        texts = list(todo)
+        results = asyncio.run(self._generate_all(texts))
+        
+        for clean_text, audio_path in zip(texts, results):
+            filename, notes = todo[clean_text]
+            if audio_path is None:
+                deferred.extend(note_id for note_id, _ in notes)
+                continue
+            
+            for note_id, audio_field_content in notes:
+                if isinstance(audio_path, Exception):
+                    log.error(f"Error processing note {note_id}: {str(audio_path)}")
+                    errors += 1
                     
-                    if sound_match:
-                        existing_filename = sound_match.group(1)
-                        
-                        # Check if the referenced file is valid
-                        if self.anki.media_file_exists(existing_filename):
-                            print(f"Audio field has valid content for note {note['noteId']} (file: {existing_filename})")
-                            skipped += 1
-                            continue
-                        else:
-                            print(f"Audio field references invalid file '{existing_filename}' for note {note['noteId']} - will regenerate")
-                            # Clear the invalid reference so we can regenerate
-                            if not dry_run:
-                                self.anki.update_note_fields(note["noteId"], {audio_field: ""})
-                    else:
-                        print(f"Audio field has unrecognized content for note {note['noteId']}: '{audio_field_content}' - will regenerate")
-                        # Clear the unrecognized content so we can regenerate  
-                        if not dry_run:
-                            self.anki.update_note_fields(note["noteId"], {audio_field: ""})
-                
-                # Generate filename and check if media file already exists in Anki
-                filename = self.generate_filename(clean_text)
-                if self.anki.media_file_exists(filename):
-                    print(f"Audio file '{filename}' already exists in Anki media collection for note {note['noteId']}")
-                    # Add the audio field reference if it's missing
-                    if audio_field not in note["fields"] or not note["fields"][audio_field]["value"].strip():
-                        audio_html = f"[sound:{filename}]"
-                        fields_to_update = {audio_field: audio_html}
-                        if not dry_run:
-                            self.anki.update_note_fields(note["noteId"], fields_to_update)
-                        print(f"Added existing audio reference to note {note['noteId']}")
-                    skipped += 1
+                    # Clear the invalid or unrecognized content so the next run regenerates it
+                    if audio_field_content:
+                        commits.append(NoteCommit(note_id, [self.anki.action(
+                            "updateNoteFields", note={"id": note_id, "fields": {audio_field: ""}}
+                        )], None))
                     continue
                 
-                print(f"Processing: {clean_text[:50]}...")
-                
-                if dry_run:
-                    print(f"[DRY RUN] Would generate TTS for: {clean_text}")
-                    processed += 1
-                    continue
-                
-                # Check cache first
-                audio_data = self.get_cached_audio(clean_text)
-                
-                if not audio_data:
-                    # Generate TTS
-                    audio_data = self.tts.generate_speech(
-                        clean_text, 
-                        stability=self.tts_stability,
-                        similarity_boost=self.tts_similarity
+                # Point each note's audio field at the file; it is stored in
+                # Anki's media folder once, before the first of these updates
+                commits.append(NoteCommit(
+                    note_id,
+                    [self._audio_field_action(note_id, audio_field, filename)],
+                    "processed",
+                    media=(filename, audio_path)
+                ))
+        
+        return commits, errors, deferred
+    
+    def resume_path(self, deck_name: str) -> Path:
+        """Path of the file listing notes a rate-limited run left for later"""
+        return self.cache_dir / f"resume_{_UNSAFE_FILENAME_RE.sub('_', deck_name)}.json"
+    
+    def load_resume(self, deck_name: str) -> set:
+        """Return the IDs of notes deferred by the previous run on this deck"""
+        try:
+            with open(self.resume_path(deck_name), 'r') as f:
+                return set(json.load(f))
+        except (OSError, ValueError):
+            return set()
+    
+    def save_resume(self, deck_name: str, note_ids: List[int]):
+        """Record notes to handle first on the next run"""
+        with open(self.resume_path(deck_name), 'w') as f:
+            json.dump(note_ids, f)
+    
+    def _audio_field_action(self, note_id: int, audio_field: str, filename: str) -> Dict:
+        """Build the action pointing a note's audio field at a media file"""
+        return self.anki.action(
+            "updateNoteFields", note={"id": note_id, "fields": {audio_field: f"[sound:{filename}]"}}
+        )
+    
+    async def _generate_all(self, texts: List[str]) -> List:
+        """Generate (or load cached) audio for each text, several requests at a time.
+        
+        Texts go through a bounded queue to a fixed pool of workers, so a
+        stalled API holds the producer back instead of piling up work. Once
+        the limiter's breaker trips, remaining texts still get their cached
+        audio, but no new audio is requested.
+        Returns the cached audio path, the raised exception or None (not
+        attempted) for each text, in order.
+        """
+        limiter = AIMDLimiter(initial=self.tts_concurrency)
+        results = [None] * len(texts)
+        queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        
+        async def worker():
+            while True:
+                index = await queue.get()
+                try:
+                    # Cached audio needs no API call, so it is used even
+                    # after the breaker trips
+                    audio_path = self.get_cached_audio(texts[index])
+                    if audio_path:
+                        log.debug(f"Using cached audio for: {texts[index][:50]}")
+                        results[index] = audio_path
+                    elif not limiter.tripped:
+                        results[index] = await self._generate_one(texts[index], limiter)
+                except Exception as e:
+                    # Failures while the breaker is open are retried next run
+                    results[index] = None if limiter.tripped else e
+                finally:
+                    queue.task_done()
+        
+        try:
+            async with self.tts.async_session():
+                workers = [asyncio.create_task(worker()) for _ in range(limiter.max)]
+                try:
+                    for index in range(len(texts)):
+                        await queue.put(index)
+                    await queue.join()
+                finally:
+                    for task in workers:
+                        task.cancel()
+                    await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            self._db.commit()
+        return results
+    
+    async def _generate_one(self, text: str, limiter: AIMDLimiter) -> Path:
+        """Generate audio for text straight into the cache and index it"""
+        audio_path = await self.tts.agenerate_speech(
+            text,
+            self.cache_path(text),
+            limiter,
+            stability=self.tts_stability,
+            similarity_boost=self.tts_similarity,
+            latency_mode=self.tts_latency_mode
+        )
+        self.index_audio(self.text_hash(text), audio_path)
+        log.debug(f"Generated new TTS audio for: {text[:50]}")
+        return audio_path
+    
+    def _commit_all(self, commits: List[NoteCommit], use_path: bool = False) -> Tuple[int, int, int]:
+        """Flush queued per-note actions in batches of about MULTI_BATCH_SIZE actions"""
+        processed = 0
+        skipped = 0
+        errors = 0
+        
+        # Outcome of each media file stored so far: None, or the error
+        stored = {}
+        
+        batch = []
+        batch_actions = 0
+        for entry in commits:
+            batch.append(entry)
+            batch_actions += len(entry.actions) + (entry.media is not None)
+            
+            if batch_actions >= MULTI_BATCH_SIZE:
+                batch_processed, batch_skipped, batch_errors = self._flush_commits(batch, use_path, stored)
+                processed += batch_processed
+                skipped += batch_skipped
+                errors += batch_errors
+                batch = []
+                batch_actions = 0
+        
+        if batch:
+            batch_processed, batch_skipped, batch_errors = self._flush_commits(batch, use_path, stored)
+            processed += batch_processed
+            skipped += batch_skipped
+            errors += batch_errors
+        
+        return processed, skipped, errors
+    
+    def _flush_commits(self, pending: List[NoteCommit], use_path: bool = False,
+                       stored: Optional[Dict[str, Optional[str]]] = None) -> Tuple[int, int, int]:
+        """Send queued per-note actions for one batch.
+        
+        AnkiConnect runs every action in a multi request even after one
+        fails, so media not yet in stored is sent first, on its own, and a
+        note is only updated once its media is known to be in Anki. Cached
+        audio is read and encoded only here, so at most one batch of it is
+        held in memory; with use_path Anki reads it from the cache itself.
+        Returns the (processed, skipped, errors) counts for the batch.
+        """
+        if stored is None:
+            stored = {}
+        processed = 0
+        skipped = 0
+        errors = 0
+        
+        # Store each new media file once
+        stores = {}
+        for entry in pending:
+            if not entry.media or entry.media[0] in stored or entry.media[0] in stores:
+                continue
+            filename, path = entry.media
+            try:
+                if use_path:
+                    stores[filename] = self.anki.action(
+                        "storeMediaFile", filename=filename, path=str(path.resolve())
                     )
-                    self.cache_audio(clean_text, audio_data)
-                    print("Generated new TTS audio")
                 else:
-                    print("Using cached audio")
-                
-                # Always store in Anki media folder to ensure it exists there
-                self.anki.store_media_file(filename, audio_data)
-                
-                # Update note with audio field
-                audio_html = f"[sound:{filename}]"
-                fields_to_update = {audio_field: audio_html}
-                self.anki.update_note_fields(note["noteId"], fields_to_update)
-                
-                processed += 1
-                print(f"Successfully added audio to note {note['noteId']}")
-                
-                # Small delay to avoid rate limiting
-                time.sleep(self.rate_limit_delay)
-                
+                    stores[filename] = self.anki.action(
+                        "storeMediaFile",
+                        filename=filename,
+                        data=base64.b64encode(path.read_bytes()).decode('utf-8')
+                    )
+            except OSError as e:
+                # The index said the file was cached but it has gone missing
+                stored[filename] = str(e)
+                self.forget_audio(filename)
+        
+        if stores:
+            try:
+                results = self.anki.multi(list(stores.values()))
             except Exception as e:
-                print(f"Error processing note {note['noteId']}: {str(e)}")
-                errors += 1
+                # Anki could not be reached, which is no fault of the files
+                for filename in stores:
+                    stored[filename] = str(e)
+            else:
+                for filename, result in zip(stores, results):
+                    error = result.get("error")
+                    stored[filename] = error
+                    if error:
+                        # Anki refused the file itself, so generate it afresh next run
+                        self.forget_audio(filename)
+        
+        # Update the notes whose media, if any, made it into Anki
+        sendable = []
+        for entry in pending:
+            error = stored.get(entry.media[0]) if entry.media else None
+            if error:
+                log.error(f"Error processing note {entry.note_id}: {error}")
+                if entry.outcome:
+                    errors += 1
+                continue
+            sendable.append(entry)
+        
+        if not sendable:
+            self._db.commit()
+            return processed, skipped, errors
+        
+        try:
+            results = self.anki.multi([action for entry in sendable for action in entry.actions])
+        except Exception as e:
+            log.error(f"Error committing batch of {len(pending)} notes: {str(e)}")
+            self._db.commit()
+            # Notes without an outcome were already counted as errors
+            return 0, 0, errors + sum(1 for entry in sendable if entry.outcome)
+        
+        position = 0
+        for note_id, actions, outcome, _ in sendable:
+            note_results = results[position:position + len(actions)]
+            position += len(actions)
+            
+            error = next((result["error"] for result in note_results if result.get("error")), None)
+            if error:
+                log.error(f"Error processing note {note_id}: {error}")
+                if outcome:
+                    errors += 1
+            elif outcome == "processed":
+                log.debug(f"Successfully added audio to note {note_id}")
+                processed += 1
+            elif outcome == "skipped":
+                skipped += 1
         
-        print(f"\nProcessing complete!")
-        print(f"Processed: {processed}")
-        print(f"Skipped: {skipped}")
-        print(f"Errors: {errors}")
+        self._db.commit()
+        return processed, skipped, errors
     
     def list_decks(self):
         """List all available decks"""
@@ -423,9 +1102,17 @@ def main():
     parser.add_argument("--list-decks", action="store_true", help="List available decks")
     parser.add_argument("--list-voices", action="store_true", help="List available voices")
     parser.add_argument("--dry-run", action="store_true", help="Show what would be processed without making changes")
+    parser.add_argument("--deep-validate", action="store_true", help="Download existing audio files and check they are valid MP3s instead of only checking they exist")
+    parser.add_argument("--verbose", action="store_true", help="Log what happens to every note")
+    parser.add_argument("--use-path", action="store_true", help="Let Anki read new audio from the local cache instead of uploading it (Anki must run on this machine)")
     
     args = parser.parse_args()
     
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s"
+    )
+    
     try:
         # Get API key from command line or environment
         api_key = args.api_key or os.getenv('ELEVENLABS_API_KEY')
@@ -442,24 +1129,29 @@ def main():
         
         processor = BulgarianTTSProcessor(api_key, voice_id)
         
-        if args.list_decks:
-            processor.list_decks()
-            return
-        
-        if args.list_voices:
-            processor.list_voices()
-            return
-        
-        if not args.deck:
-            print("Please specify a deck name with --deck or use --list-decks to see available decks")
-            return
-        
-        processor.process_deck(
-            deck_name=args.deck,
-            bulgarian_field=bulgarian_field,
-            audio_field=audio_field,
-            dry_run=args.dry_run
-        )
+        try:
+            if args.list_decks:
+                processor.list_decks()
+                return
+            
+            if args.list_voices:
+                processor.list_voices()
+                return
+            
+            if not args.deck:
+                print("Please specify a deck name with --deck or use --list-decks to see available decks")
+                return
+            
+            processor.process_deck(
+                deck_name=args.deck,
+                bulgarian_field=bulgarian_field,
+                audio_field=audio_field,
+                dry_run=args.dry_run,
+                deep_validate=args.deep_validate,
+                use_path=args.use_path
+            )
+        finally:
+            processor.close()
         
     except Exception as e:
         print(f"Error: {str(e)}")